@@ -1,21 +1,141 @@
 import os
 import logging
-from flask import Flask, jsonify, request, render_template_string
+import re
+import threading
+import time
+import unicodedata
+import google.auth
+import orjson
+import requests
+from cachetools import TTLCache
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import JSONProvider
+from jinja2 import Template
+from markupsafe import escape
+from urllib.parse import quote
+from google.auth.transport.requests import Request as AuthRequest
 from google.cloud import storage
-from google.api_core.exceptions import GoogleAPIError
-import traceback
+from google.cloud.storage.retry import DEFAULT_RETRY
+from google.api_core.exceptions import GoogleAPIError, NotFound, PreconditionFailed, RequestRangeNotSatisfiable
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, used by jsonify."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Build the body as bytes directly instead of going through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+def get_env_int(name, default):
+    """Read an integer setting from the environment, falling back on bad input."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning("Ignoring non-integer %s=%r, using %s", name, value, default)
+        return default
 
 # Get bucket name from environment variable
 BUCKET_NAME = os.environ.get('GCS_BUCKET_NAME', 'your-bucket-name')
 
-# HTML template for the home page
-HOME_TEMPLATE = '''
+# Chunk size for resumable uploads (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Bytes shown in the HTML preview, and chunk size for raw download streaming
+PREVIEW_BYTES = 64 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Objects shown per /list page (the GCS API caps a page at 1000)
+LIST_PAGE_SIZE = 100
+MAX_LIST_PAGE_SIZE = 1000
+
+# Recently listed pages, keyed by (page_token, limit). Kept briefly to absorb
+# repeated /list clicks. The cache is per process: a write clears it only in
+# the worker that handled it, so other workers may serve a listing up to
+# LIST_CACHE_TTL seconds stale.
+LIST_CACHE_TTL = 5
+_LIST_CACHE = TTLCache(maxsize=32, ttl=LIST_CACHE_TTL)
+_LIST_CACHE_LOCK = threading.Lock()
+
+# Object names from the last listing that covered the whole bucket. While it is
+# fresh, downloads of names not in it are answered with a 404 without a GCS
+# round-trip. The set only sees this process's writes, so it is never used to
+# answer deletes, and it is off unless KNOWN_NAMES_LOOKUP=1. Only enable it
+# when a single process (one worker, one pod) is the bucket's only writer.
+KNOWN_NAMES_LOOKUP = os.environ.get('KNOWN_NAMES_LOOKUP') == '1'
+_KNOWN_NAMES = set()
+_KNOWN_NAMES_EXPIRES = 0.0
+# Bumped on every upload or delete so a listing that overlapped a write is
+# not recorded over it
+_write_count = 0
+
+def write_count():
+    """Return the number of uploads and deletes this process has made."""
+    with _LIST_CACHE_LOCK:
+        return _write_count
+
+def cache_listing(key, files, next_page_token, writes_seen):
+    """Cache a listing page unless this process wrote to the bucket meanwhile."""
+    with _LIST_CACHE_LOCK:
+        if _write_count == writes_seen:
+            _LIST_CACHE[key] = (files, next_page_token)
+
+def remember_names(names, writes_seen):
+    """Record the complete set of object names from a fresh listing.
+    
+    The listing is dropped if this process wrote to the bucket after
+    writes_seen was taken, since it may predate that write.
+    """
+    global _KNOWN_NAMES_EXPIRES
+    with _LIST_CACHE_LOCK:
+        if _write_count != writes_seen:
+            return
+        _KNOWN_NAMES.clear()
+        _KNOWN_NAMES.update(names)
+        _KNOWN_NAMES_EXPIRES = time.monotonic() + LIST_CACHE_TTL
+
+def note_uploaded(filename):
+    """Record a successful upload: drop cached listings and add the name."""
+    global _write_count
+    with _LIST_CACHE_LOCK:
+        _write_count += 1
+        _LIST_CACHE.clear()
+        _KNOWN_NAMES.add(filename)
+
+def note_deleted(filename):
+    """Record a successful delete: drop cached listings and remove the name."""
+    global _write_count
+    with _LIST_CACHE_LOCK:
+        _write_count += 1
+        _LIST_CACHE.clear()
+        _KNOWN_NAMES.discard(filename)
+
+def known_missing(filename):
+    """Return True if a fresh complete listing shows filename does not exist."""
+    if not KNOWN_NAMES_LOOKUP:
+        return False
+    with _LIST_CACHE_LOCK:
+        return time.monotonic() < _KNOWN_NAMES_EXPIRES and filename not in _KNOWN_NAMES
+
+# HTML for the home page, split so the static parts are rendered only once.
+# The service-account identity is inserted between the header and controls.
+HOME_HEADER = '''
 <!DOCTYPE html>
 <html>
 <head>
@@ -39,7 +159,9 @@ HOME_TEMPLATE = '''
         <h1>Google Cloud Storage Access Demo</h1>
         <div class="card">
             <h2>Identity Information</h2>
-            <p><strong>Service Account:</strong> {{ identity }}</p>
+            <p><strong>Service Account:</strong> '''
+
+HOME_CONTROLS = '''</p>
             <p><strong>Bucket Name:</strong> {{ bucket_name }}</p>
         </div>
         
@@ -72,6 +194,9 @@ HOME_TEMPLATE = '''
             </form>
         </div>
         
+'''
+
+HOME_RESULTS_TEMPLATE = '''
         {% if message %}
         <div class="{{ message_class }}">
             {{ message }}
@@ -86,100 +211,234 @@ HOME_TEMPLATE = '''
                 <li>{{ file }}</li>
             {% endfor %}
             </ul>
+            {% if next_page_token %}
+            <a href="/list?page_token={{ next_page_token|urlencode }}&limit={{ limit }}" class="btn">Next Page</a>
+            {% endif %}
         </div>
         {% endif %}
-    </div>
+'''
+
+HOME_FOOTER = '''    </div>
 </body>
 </html>
 '''
 
-def get_storage_client():
-    """Initialize and return a GCS client."""
+# Result pages are filled with %-substitution; every dynamic value is
+# HTML-escaped with markupsafe before it is inserted.
+UPLOAD_PAGE = '''
+<html>
+<body>
+    <h2>Upload Successful!</h2>
+    <p>File %(filename)s uploaded to %(bucket_name)s</p>
+    <a href="/">Back to Home</a>
+</body>
+</html>
+'''
+
+DOWNLOAD_PAGE = '''
+<html>
+<body>
+    <h2>File Content: %(filename)s</h2>
+    <pre>%(content)s</pre>
+    %(truncated)s
+    <a href="/download?filename=%(quoted_filename)s&raw=1">Download full file</a>
+    <a href="/">Back to Home</a>
+</body>
+</html>
+'''
+
+TRUNCATED_NOTE = '<p>Preview truncated to the first %d bytes.</p>' % PREVIEW_BYTES
+
+DELETE_PAGE = '''
+<html>
+<body>
+    <h2>Delete Successful!</h2>
+    <p>File %(filename)s deleted from %(bucket_name)s</p>
+    <a href="/">Back to Home</a>
+</body>
+</html>
+'''
+
+# Compile the results template once at import. Autoescape matches render_template_string.
+HOME_RESULTS_TMPL = Template(HOME_RESULTS_TEMPLATE, autoescape=True)
+
+# The bucket name never changes, so escape it once
+BUCKET_NAME_HTML = str(escape(BUCKET_NAME))
+
+def get_default_credentials():
+    """Discover application default credentials and project."""
     try:
         # IMPORTANT: No authentication options needed!
         # Workload Identity automatically handles authentication
-        client = storage.Client()
+        return google.auth.default()
+    except Exception:
+        logger.exception("Failed to discover default credentials")
+        return None, None
+
+# Discovered once and passed to every client, so new clients never repeat the
+# metadata-server lookup. The credentials refresh their own tokens.
+CREDENTIALS, PROJECT_ID = get_default_credentials()
+
+def get_storage_client():
+    """Initialize and return a GCS client."""
+    if CREDENTIALS is None:
+        # Discovery already failed and was logged; don't repeat it here
+        return None
+    try:
+        client = storage.Client(project=PROJECT_ID, credentials=CREDENTIALS)
         logger.info("Successfully created storage client")
         return client
-    except Exception as e:
-        logger.error(f"Failed to create storage client: {str(e)}")
-        logger.error(traceback.format_exc())
+    except Exception:
+        logger.exception("Failed to create storage client")
         return None
 
+# Shared client, built once at startup. Its underlying requests session is
+# thread-safe and keeps HTTPS connections alive across requests.
+STORAGE_CLIENT = get_storage_client()
+
+# Keep one pooled connection per request thread sharing this client, so none
+# has to open a fresh TLS connection. requests already pools 10 per host, so
+# the pool is only resized when gunicorn runs more threads than that. The
+# session's own https adapter is resized in place to keep its TLS setup
+# (e.g. the mTLS adapter).
+HTTP_POOL_SIZE = get_env_int('GUNICORN_THREADS', 8)
+if STORAGE_CLIENT and HTTP_POOL_SIZE > DEFAULT_POOLSIZE:
+    STORAGE_CLIENT._http.get_adapter('https://').init_poolmanager(HTTP_POOL_SIZE, HTTP_POOL_SIZE)
+
+# Bucket handle shared by all routes; constructing it makes no API call
+BUCKET = STORAGE_CLIENT.bucket(BUCKET_NAME) if STORAGE_CLIENT else None
+
+# GCS object names: 1-1024 bytes of UTF-8, no CR/LF, and not "." or "..".
+# The regex covers the characters; get_blob checks the encoded length.
+FILENAME_RE = re.compile(r'(?!\.\.?\Z)[^\r\n]+')
+MAX_FILENAME_BYTES = 1024
+
+def get_blob(filename):
+    """Return a blob handle for filename, or None if the name is not valid."""
+    if not filename or not FILENAME_RE.fullmatch(filename):
+        return None
+    if len(filename.encode('utf-8')) > MAX_FILENAME_BYTES:
+        return None
+    return BUCKET.blob(filename)
+
+# Pooled session for metadata server lookups
+METADATA_SESSION = requests.Session()
+METADATA_SESSION.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+# Shared transport for credential refreshes in /health, with a lock so
+# concurrent probes do not refresh the shared credentials at the same time
+AUTH_REQUEST = AuthRequest(session=requests.Session())
+_REFRESH_LOCK = threading.Lock()
+
+# The identity is fixed for the life of the pod, so it is looked up once.
+# Only the metadata server's answer is cached. After a failed lookup the
+# fallback is served until the retry interval passes, so an unreachable
+# metadata server does not stall every page render.
+IDENTITY_RETRY_SECONDS = 60
+UNKNOWN_IDENTITY = "Unknown (Not properly authenticated)"
+_identity = None
+_identity_fallback = UNKNOWN_IDENTITY
+_identity_retry_at = 0.0
+
 def get_identity():
     """Get the current service account identity."""
+    global _identity, _identity_fallback, _identity_retry_at
+    if _identity is not None:
+        return _identity
+    if time.monotonic() < _identity_retry_at:
+        return _identity_fallback
     try:
-        client = storage.Client()
         # This will fail if not properly authenticated
-        project = client.project
+        project = STORAGE_CLIENT.project
         # Try to get the email from metadata server
-        import requests
-        response = requests.get(
+        response = METADATA_SESSION.get(
             'http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/email',
             headers={'Metadata-Flavor': 'Google'},
             timeout=5
         )
         if response.status_code == 200:
-            return response.text
-        return f"Authenticated (Project: {project})"
+            _identity = response.text
+            return _identity
+        logger.warning("Metadata server returned %s for identity", response.status_code)
+        _identity_fallback = f"Authenticated (Project: {project})"
     except Exception as e:
-        logger.error(f"Failed to get identity: {str(e)}")
-        return "Unknown (Not properly authenticated)"
+        logger.error("Failed to get identity: %s", e)
+        _identity_fallback = UNKNOWN_IDENTITY
+    _identity_retry_at = time.monotonic() + IDENTITY_RETRY_SECONDS
+    return _identity_fallback
+
+# Static parts of the home page that do not change after startup
+_HOME_CONTROLS = Template(HOME_CONTROLS, autoescape=True).render(bucket_name=BUCKET_NAME)
+
+def render_home(**context):
+    """Render the home page, running Jinja only over the results fragment."""
+    return ''.join((
+        HOME_HEADER,
+        escape(get_identity()),
+        _HOME_CONTROLS,
+        HOME_RESULTS_TMPL.render(**context),
+        HOME_FOOTER
+    ))
 
 @app.route('/')
 def home():
     """Home page."""
-    return render_template_string(
-        HOME_TEMPLATE,
-        identity=get_identity(),
-        bucket_name=BUCKET_NAME,
+    return render_home(
         message=request.args.get('message', ''),
         message_class=request.args.get('message_class', '')
     )
 
 @app.route('/list')
 def list_objects():
-    """List all objects in the bucket."""
+    """List one page of objects in the bucket."""
     try:
-        client = get_storage_client()
-        if not client:
-            return render_template_string(
-                HOME_TEMPLATE,
-                identity=get_identity(),
-                bucket_name=BUCKET_NAME,
+        if BUCKET is None:
+            return render_home(
                 message="Failed to create storage client. Check Workload Identity configuration.",
                 message_class="error"
             )
         
-        bucket = client.bucket(BUCKET_NAME)
-        blobs = list(bucket.list_blobs())
+        limit = request.args.get('limit', LIST_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_LIST_PAGE_SIZE))
+        
+        page_token = request.args.get('page_token')
         
-        files = [blob.name for blob in blobs]
+        key = (page_token, limit)
+        with _LIST_CACHE_LOCK:
+            cached = _LIST_CACHE.get(key)
+        if cached:
+            files, next_page_token = cached
+        else:
+            writes_seen = write_count()
+            # Fetch a single API page, requesting only object names
+            iterator = BUCKET.list_blobs(
+                max_results=limit,
+                page_token=page_token,
+                fields='items(name),nextPageToken'
+            )
+            files = [blob.name for blob in next(iterator.pages)]
+            next_page_token = iterator.next_page_token
+            cache_listing(key, files, next_page_token, writes_seen)
+            if not page_token and not next_page_token:
+                # This single page is the whole bucket
+                remember_names(files, writes_seen)
         
-        return render_template_string(
-            HOME_TEMPLATE,
-            identity=get_identity(),
-            bucket_name=BUCKET_NAME,
+        return render_home(
             files=files,
-            message=f"Found {len(files)} files in bucket",
+            next_page_token=next_page_token,
+            limit=limit,
+            message=f"Showing {len(files)} files from bucket",
             message_class="success"
         )
     except GoogleAPIError as e:
-        logger.error(f"GCS API error: {str(e)}")
-        return render_template_string(
-            HOME_TEMPLATE,
-            identity=get_identity(),
-            bucket_name=BUCKET_NAME,
+        logger.error("GCS API error: %s", e)
+        return render_home(
             message=f"GCS Error: {str(e)}",
             message_class="error"
         )
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        logger.error(traceback.format_exc())
-        return render_template_string(
-            HOME_TEMPLATE,
-            identity=get_identity(),
-            bucket_name=BUCKET_NAME,
+        logger.exception("Unexpected error listing bucket")
+        return render_home(
             message=f"Error: {str(e)}",
             message_class="error"
         )
@@ -195,106 +454,150 @@ def upload_file():
         if file.filename == '':
             return "No selected file", 400
         
-        client = get_storage_client()
-        if not client:
+        if BUCKET is None:
             return "Storage client error", 500
         
-        bucket = client.bucket(BUCKET_NAME)
-        blob = bucket.blob(file.filename)
+        blob = get_blob(file.filename)
+        if blob is None:
+            return "Invalid filename", 400
         
-        # Upload the file
-        blob.upload_from_file(file)
+        # Resumable uploads buffer one chunk at a time; an 8 MiB chunk instead
+        # of the 100 MiB default bounds the per-upload buffer. The generation
+        # precondition makes this create-only, which also makes it safe to retry.
+        blob.chunk_size = UPLOAD_CHUNK_SIZE
+        try:
+            blob.upload_from_file(
+                file,
+                rewind=True,
+                checksum=None,
+                timeout=300,
+                if_generation_match=0,
+                retry=DEFAULT_RETRY
+            )
+        except PreconditionFailed:
+            return f"File {escape(file.filename)} already exists", 409
         
-        logger.info(f"Successfully uploaded {file.filename}")
-        return f'''
-        <html>
-        <body>
-            <h2>Upload Successful!</h2>
-            <p>File {file.filename} uploaded to {BUCKET_NAME}</p>
-            <a href="/">Back to Home</a>
-        </body>
-        </html>
-        '''
+        note_uploaded(file.filename)
+        logger.info("Successfully uploaded %s", file.filename)
+        return UPLOAD_PAGE % {'filename': escape(file.filename), 'bucket_name': BUCKET_NAME_HTML}
     except Exception as e:
-        logger.error(f"Upload error: {str(e)}")
-        return f"Error uploading file: {str(e)}", 500
+        logger.exception("Upload error")
+        return f"Error uploading file: {escape(e)}", 500
+
+def content_disposition(filename):
+    """Build an attachment header that is latin-1 safe for any object name."""
+    name = os.path.basename(filename) or 'download'
+    # ASCII fallback for old clients, plus the exact name per RFC 5987
+    fallback = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    fallback = ''.join(c for c in fallback if c.isprintable() and c not in '"\\') or 'download'
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+def stream_blob(blob, filename):
+    """Stream a blob to the client chunk by chunk instead of buffering it."""
+    reader = blob.open('rb', chunk_size=STREAM_CHUNK_SIZE)
+    try:
+        # Read the first chunk eagerly so a missing object still yields a 404
+        first = reader.read(STREAM_CHUNK_SIZE)
+    except NotFound:
+        reader.close()
+        return f"File {escape(filename)} not found", 404
+    
+    def generate():
+        try:
+            chunk = first
+            while chunk:
+                yield chunk
+                chunk = reader.read(STREAM_CHUNK_SIZE)
+        finally:
+            reader.close()
+    
+    return Response(
+        generate(),
+        mimetype='application/octet-stream',
+        headers={'Content-Disposition': content_disposition(filename)}
+    )
 
 @app.route('/download')
 def download_file():
     """Download a file from GCS."""
     try:
-        filename = request.args.get('filename')
-        if not filename:
-            return "Filename required", 400
-        
-        client = get_storage_client()
-        if not client:
+        if BUCKET is None:
             return "Storage client error", 500
         
-        bucket = client.bucket(BUCKET_NAME)
-        blob = bucket.blob(filename)
+        filename = request.args.get('filename')
+        blob = get_blob(filename)
+        if blob is None:
+            return "Valid filename required", 400
+        
+        if known_missing(filename):
+            return f"File {escape(filename)} not found", 404
         
-        if not blob.exists():
-            return f"File {filename} not found", 404
+        if request.args.get('raw'):
+            return stream_blob(blob, filename)
         
-        # Download as string (for text files)
-        content = blob.download_as_text()
+        # Only fetch the head of the object for the HTML preview; a missing
+        # object raises NotFound
+        try:
+            # One byte past the preview tells whether the object is longer
+            data = blob.download_as_bytes(start=0, end=PREVIEW_BYTES)
+        except NotFound:
+            return f"File {escape(filename)} not found", 404
+        except RequestRangeNotSatisfiable:
+            # Empty objects have no byte range to return
+            data = b''
         
-        return f'''
-        <html>
-        <body>
-            <h2>File Content: {filename}</h2>
-            <pre>{content}</pre>
-            <a href="/">Back to Home</a>
-        </body>
-        </html>
-        '''
+        return DOWNLOAD_PAGE % {
+            'filename': escape(filename),
+            'content': escape(data[:PREVIEW_BYTES].decode('utf-8', errors='replace')),
+            'truncated': TRUNCATED_NOTE if len(data) > PREVIEW_BYTES else '',
+            'quoted_filename': quote(filename, safe='')
+        }
     except Exception as e:
-        logger.error(f"Download error: {str(e)}")
-        return f"Error downloading file: {str(e)}", 500
+        logger.exception("Download error")
+        return f"Error downloading file: {escape(e)}", 500
 
 @app.route('/delete', methods=['POST'])
 def delete_file():
     """Delete a file from GCS."""
     try:
-        filename = request.form.get('filename')
-        if not filename:
-            return "Filename required", 400
-        
-        client = get_storage_client()
-        if not client:
+        if BUCKET is None:
             return "Storage client error", 500
         
-        bucket = client.bucket(BUCKET_NAME)
-        blob = bucket.blob(filename)
-        
-        if not blob.exists():
-            return f"File {filename} not found", 404
+        filename = request.form.get('filename')
+        blob = get_blob(filename)
+        if blob is None:
+            return "Valid filename required", 400
         
-        blob.delete()
-        logger.info(f"Successfully deleted {filename}")
+        try:
+            blob.delete()
+        except NotFound:
+            return f"File {escape(filename)} not found", 404
+        note_deleted(filename)
+        logger.info("Successfully deleted %s", filename)
         
-        return f'''
-        <html>
-        <body>
-            <h2>Delete Successful!</h2>
-            <p>File {filename} deleted from {BUCKET_NAME}</p>
-            <a href="/">Back to Home</a>
-        </body>
-        </html>
-        '''
+        return DELETE_PAGE % {'filename': escape(filename), 'bucket_name': BUCKET_NAME_HTML}
     except Exception as e:
-        logger.error(f"Delete error: {str(e)}")
-        return f"Error deleting file: {str(e)}", 500
+        logger.exception("Delete error")
+        return f"Error deleting file: {escape(e)}", 500
 
 @app.route('/health')
 def health():
-    """Health check endpoint."""
+    """Health check endpoint.
+    
+    Checks credentials locally, refreshing them only when needed. Pass
+    ?deep=1 to also make a GCS API call.
+    """
     try:
-        client = get_storage_client()
+        client = STORAGE_CLIENT
         if client:
-            # Try to list buckets to verify authentication
-            list(client.list_buckets(max_results=1))
+            credentials = client._credentials
+            if not credentials.valid:
+                with _REFRESH_LOCK:
+                    if not credentials.valid:
+                        credentials.refresh(AUTH_REQUEST)
+            if request.args.get('deep'):
+                # Try to list buckets to verify authentication
+                list(client.list_buckets(max_results=1))
             return jsonify({"status": "healthy", "authenticated": True})
         return jsonify({"status": "unhealthy", "authenticated": False}), 500
     except Exception as e:
@@ -302,4 +605,5 @@ def health():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    # Local development only; the container runs the app under gunicorn
+    app.run(host='0.0.0.0', port=port)
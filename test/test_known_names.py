@@ -0,0 +1,92 @@
+"""
+Unit tests for the in-process listing cache and known-names lookup.
+These run without GCS access; the app imports with no credentials.
+"""
+
+import importlib
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("google.cloud.storage")
+
+import app
+
+
+@pytest.fixture(autouse=True)
+def known_names(monkeypatch):
+    """Start each test with the lookup enabled and nothing recorded."""
+    monkeypatch.setattr(app, "KNOWN_NAMES_LOOKUP", True)
+    monkeypatch.setattr(app, "_KNOWN_NAMES", set())
+    monkeypatch.setattr(app, "_KNOWN_NAMES_EXPIRES", 0.0)
+    monkeypatch.setattr(app, "_write_count", 0)
+    monkeypatch.setattr(app, "_LIST_CACHE", app.TTLCache(maxsize=32, ttl=app.LIST_CACHE_TTL))
+
+
+def test_nothing_is_missing_without_a_listing():
+    assert not app.known_missing("a.txt")
+
+
+def test_complete_listing_answers_missing_names():
+    app.remember_names(["a.txt"], app.write_count())
+    assert not app.known_missing("a.txt")
+    assert app.known_missing("b.txt")
+
+
+def test_listing_expires(monkeypatch):
+    app.remember_names(["a.txt"], app.write_count())
+    now = app.time.monotonic()
+    monkeypatch.setattr(app.time, "monotonic", lambda: now + app.LIST_CACHE_TTL + 1)
+    assert not app.known_missing("b.txt")
+
+
+def test_upload_and_delete_update_names():
+    app.remember_names(["a.txt"], app.write_count())
+    app.note_uploaded("b.txt")
+    assert not app.known_missing("b.txt")
+    app.note_deleted("a.txt")
+    assert app.known_missing("a.txt")
+
+
+def test_listing_that_overlaps_a_write_is_dropped():
+    writes_seen = app.write_count()
+    app.note_uploaded("b.txt")
+    # A listing fetched before the upload finishes afterwards
+    app.remember_names(["a.txt"], writes_seen)
+    assert not app.known_missing("b.txt")
+
+
+def test_lookup_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("KNOWN_NAMES_LOOKUP", raising=False)
+    monkeypatch.setenv("GUNICORN_WORKERS", "1")
+    assert importlib.reload(app).KNOWN_NAMES_LOOKUP is False
+
+
+def test_lookup_enabled_by_env(monkeypatch):
+    monkeypatch.setenv("KNOWN_NAMES_LOOKUP", "1")
+    assert importlib.reload(app).KNOWN_NAMES_LOOKUP is True
+
+
+def test_disabled_lookup_never_answers(monkeypatch):
+    monkeypatch.setattr(app, "KNOWN_NAMES_LOOKUP", False)
+    app.remember_names(["a.txt"], app.write_count())
+    assert not app.known_missing("b.txt")
+
+
+def test_listing_is_cached():
+    app.cache_listing((None, 100), ["a.txt"], None, app.write_count())
+    assert app._LIST_CACHE[(None, 100)] == (["a.txt"], None)
+
+
+def test_upload_clears_cached_listings():
+    app.cache_listing((None, 100), ["a.txt"], None, app.write_count())
+    app.note_uploaded("b.txt")
+    assert (None, 100) not in app._LIST_CACHE
+
+
+def test_cached_listing_that_overlaps_a_write_is_dropped():
+    writes_seen = app.write_count()
+    app.note_deleted("a.txt")
+    # A listing fetched before the delete finishes afterwards
+    app.cache_listing((None, 100), ["a.txt"], None, writes_seen)
+    assert (None, 100) not in app._LIST_CACHE